@@ -1,14 +1,21 @@
 import os
 import json
 import re
+import functools
+import sched
+import time
 import requests
+from requests.adapters import HTTPAdapter
 import hashlib
 import difflib
-from datetime import datetime, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from zoneinfo import ZoneInfo
 from pathlib import Path
 
+from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from soupsieve import SelectorSyntaxError
 from playwright.sync_api import sync_playwright, TimeoutError as PWTimeoutError
 
 load_dotenv()
@@ -16,22 +23,55 @@ load_dotenv()
 STATE_DIR = Path("state")
 STATE_DIR.mkdir(exist_ok=True)
 STATE_FILE = STATE_DIR / "last_snapshot.json"
+LAST_TEXT_FILE = STATE_DIR / "last_text.txt"
+# Playwright storage_state (session cookies) — never commit this
+AUTH_FILE = STATE_DIR / "auth.json"
 SNAPSHOT_DIR = STATE_DIR / "snapshots"
 SNAPSHOT_DIR.mkdir(exist_ok=True)
+# How many snapshots (by timestamp) to keep around; 0 keeps everything
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "200"))
 
-def get_pushover_users() -> list[str]:
+# Quiet hours and snapshot names are in Central time
+_CT = ZoneInfo("America/Chicago")
+
+PUSHOVER_URL = "https://api.pushover.net/1/messages.json"
+
+# One keep-alive session for the whole run so every user after the first
+# reuses the warm TLS connection to api.pushover.net.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Chromium flags for a headless fetch-one-page workload
+CHROMIUM_ARGS = [
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--blink-settings=imagesEnabled=false",
+]
+
+_WORD_RE = re.compile(r"\w+")
+
+@functools.lru_cache(maxsize=1)
+def get_pushover_users() -> tuple[str, ...]:
     # Preferred: PUSHOVER_USER_KEYS="key1,key2,key3"
     raw = (os.getenv("PUSHOVER_USER_KEY") or "").strip()
     if raw:
-        return [u.strip() for u in raw.split(",") if u.strip()]
+        return tuple(u.strip() for u in raw.split(",") if u.strip())
 
     # Backwards compatible: single key
     single = (os.getenv("PUSHOVER_USER_KEY") or "").strip()
-    return [single] if single else []
+    return (single,) if single else ()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_token() -> str:
+    return (os.getenv("PUSHOVER_APP_TOKEN") or "").strip()
 
 
 def send_pushover(message: str, title: str = "Watcher"):
-    token = (os.getenv("PUSHOVER_APP_TOKEN") or "").strip()
+    token = _get_token()
     users = get_pushover_users()
 
     if not token:
@@ -43,24 +83,32 @@ def send_pushover(message: str, title: str = "Watcher"):
     # if len(message) > PUSHOVER_MAX_CHARS:
     #     message = message[:PUSHOVER_MAX_CHARS - 3] + "..."
 
-    errors = []
-    results = []
-
-    for user in users:
-        payload = {
+    payloads = [
+        {
             "token": token,
             "user": user,
             "message": message,
             "title": title,
         }
-        try:
-            r = requests.post("https://api.pushover.net/1/messages.json", data=payload, timeout=15)
-            if r.status_code != 200:
-                errors.append(f"user={user} status={r.status_code} body={r.text}")
-            else:
-                results.append(r.json())
-        except requests.RequestException as e:
-            errors.append(f"user={user} exception={e}")
+        for user in users
+    ]
+
+    errors = []
+    results = []
+
+    # Send to every user at once; the workers share the pooled session above.
+    with ThreadPoolExecutor(max_workers=min(8, len(payloads))) as ex:
+        futs = {ex.submit(_SESSION.post, PUSHOVER_URL, data=p, timeout=15): p["user"] for p in payloads}
+        for fut in as_completed(futs):
+            user = futs[fut]
+            try:
+                r = fut.result()
+                if r.status_code != 200:
+                    errors.append(f"user={user} status={r.status_code} body={r.text}")
+                else:
+                    results.append(r.json())
+            except requests.RequestException as e:
+                errors.append(f"user={user} exception={e}")
 
     if errors:
         raise RuntimeError("Pushover failures:\n" + "\n".join(errors))
@@ -68,22 +116,79 @@ def send_pushover(message: str, title: str = "Watcher"):
     return results
 
 
+def rate_limit(state: dict, key: str, per_hour: int = 30) -> bool:
+    # Sliding one-hour window of send times, persisted with the rest of the state.
+    # Wall-clock seconds, since the window has to survive across runs.
+    now = time.time()
+    sends = [t for t in state.setdefault("last_sends", {}).get(key, []) if t > now - 3600]
+    allowed = len(sends) < per_hour
+    if allowed:
+        sends.append(now)
+    state["last_sends"][key] = sends
+    return allowed
+
+
 def normalize_text(s: str) -> str:
     # Remove excessive whitespace and common “noise” patterns if needed
-    s = s.replace("\u00a0", " ")
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    # (str.split() with no args collapses any run of Unicode whitespace and drops the ends)
+    return " ".join(s.replace("\u00a0", " ").split())
 
 def sha256(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
+def tokens_hash(s: str) -> str:
+    # Case/punctuation-insensitive fingerprint; word order still matters
+    return sha256(" ".join(_WORD_RE.findall(s.lower())))
+
+def write_atomic(path: Path, text: str, fsync: bool = False):
+    # Write next to the target and swap it in so a crash never leaves a half-written file
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def prune_snapshots(keep: int = SNAPSHOT_KEEP):
+    # Files for one snapshot share a timestamp prefix: <stamp>.txt, <stamp>.diff.txt, <stamp>.missing_selector.*
+    groups: dict[str, list[Path]] = {}
+    for f in SNAPSHOT_DIR.iterdir():
+        groups.setdefault(f.name.split(".", 1)[0], []).append(f)
+
+    if keep <= 0 or len(groups) <= keep:
+        return
+
+    by_age = sorted(groups, key=lambda stamp: max(f.stat().st_mtime for f in groups[stamp]))
+    for stamp in by_age[:-keep]:
+        for f in groups[stamp]:
+            f.unlink(missing_ok=True)
+
 def load_last():
     if not STATE_FILE.exists():
         return None
     return json.loads(STATE_FILE.read_text(encoding="utf-8"))
 
-def save_state(data: dict):
-    STATE_FILE.write_text(json.dumps(data, indent=2), encoding="utf-8")
+def load_auth() -> dict | None:
+    # A missing or unreadable session just means logging in again
+    try:
+        auth = json.loads(AUTH_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(auth, dict) or not isinstance(auth.get("cookies"), list):
+        return None
+    return auth
+
+def load_last_text(last: dict) -> str:
+    # Only needed for diffing, so it lives outside the (small) state file
+    if LAST_TEXT_FILE.exists():
+        return LAST_TEXT_FILE.read_text(encoding="utf-8")
+    # Older state files embedded the text directly
+    return last.get("text", "")
+
+def save_state(data: dict, text: str):
+    write_atomic(LAST_TEXT_FILE, text, fsync=True)
+    write_atomic(STATE_FILE, json.dumps(data, indent=2), fsync=True)
 
 def write_diff(old_text: str, new_text: str) -> str:
     diff = difflib.unified_diff(
@@ -95,96 +200,253 @@ def write_diff(old_text: str, new_text: str) -> str:
     )
     return "\n".join(diff)
 
-def main():
-    now = datetime.now(ZoneInfo("America/Chicago")).time()
-
-    if time(0, 0) <= now < time(7, 0):
-        print("Skipping due to quiet hours (12:00 AM–7:00 AM CT).")
-        return
-    
-    login_url = os.environ["LOGIN_URL"]
-    target_url = os.environ["TARGET_URL"]
-    username = os.environ["USERNAME"]
-    password = os.environ["PASSWORD"]
-
-    user_sel = os.environ["USERNAME_SELECTOR"]
-    pass_sel = os.environ["PASSWORD_SELECTOR"]
-    submit_sel = os.environ["SUBMIT_SELECTOR"]
-    content_sel = os.environ.get("CONTENT_SELECTOR", "body")
-
-    last = load_last()
-    last_hash = last["hash"] if last else None
-    last_text = last["text"] if last else ""
+def select_text(soup: BeautifulSoup, selector: str) -> str | None:
+    # None when nothing matches or the selector isn't plain CSS (text=, >>, ...)
+    try:
+        node = soup.select_one(selector)
+    except SelectorSyntaxError:
+        return None
+    if node is None:
+        return None
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        ctx = browser.new_context()
-        page = ctx.new_page()
+    # Closer to what inner_text() returns (it still differs on hidden/inline text,
+    # which is why this is only used on the opt-in FAST_FETCH path)
+    for tag in node.select("script, style, noscript, template"):
+        tag.decompose()
+    return node.get_text(" ")
+
+class Watcher:
+    """Keeps one browser and logged-in context alive across checks."""
+
+    def __init__(self):
+        self.login_url = os.environ["LOGIN_URL"]
+        self.target_url = os.environ["TARGET_URL"]
+        self.username = os.environ["USERNAME"]
+        self.password = os.environ["PASSWORD"]
+
+        self.user_sel = os.environ["USERNAME_SELECTOR"]
+        self.pass_sel = os.environ["PASSWORD_SELECTOR"]
+        self.submit_sel = os.environ["SUBMIT_SELECTOR"]
+        self.content_sel = os.environ.get("CONTENT_SELECTOR", "body")
+        # FAST_FETCH=1 tries a plain HTTP GET with the saved session before using the browser
+        self.fast_fetch = os.getenv("FAST_FETCH") == "1"
+
+        # Started on first use so quiet-hours runs never launch Chromium
+        self.p = None
+        self.browser = None
+        self.ctx = None
+
+    def start(self):
+        self.p = sync_playwright().start()
+        self.browser = self.p.chromium.launch(headless=True, args=CHROMIUM_ARGS)
+        # Reuse the saved session so warm starts skip the login form
+        self.ctx = self.browser.new_context(
+            storage_state=load_auth(),
+            service_workers="block",
+        )
+
+    def close(self):
+        # Clear first so the next fetch_content() relaunches even if shutdown fails
+        p, browser = self.p, self.browser
+        self.p = None
+        self.browser = None
+        self.ctx = None
+        try:
+            if browser is not None:
+                browser.close()
+        finally:
+            if p is not None:
+                p.stop()
 
+    def login(self, page):
         # Go to login page
-        page.goto(login_url, wait_until="domcontentloaded")
+        page.goto(self.login_url, wait_until="domcontentloaded")
+        # Compare against where we actually landed (redirects, trailing "/"), not LOGIN_URL
+        before = page.url
 
         # Fill and submit login form
-        page.fill(user_sel, username)
-        page.fill(pass_sel, password)
-        page.click(submit_sel)
+        page.fill(self.user_sel, self.username)
+        page.fill(self.pass_sel, self.password)
+        page.click(self.submit_sel)
 
-        # Wait for navigation / authenticated state
+        # Wait for navigation away from the login page
         try:
-            page.wait_for_load_state("networkidle", timeout=20000)
+            page.wait_for_url(lambda u: u != before, timeout=20000)
         except PWTimeoutError:
-            # Some sites never go "idle" — not fatal.
+            # Some sites post back to the same URL — needs_login() catches real failures.
             pass
 
-        # Go to the target page you want to monitor
-        page.goto(target_url, wait_until="domcontentloaded")
+    def open_target(self, page):
+        page.goto(self.target_url, wait_until="domcontentloaded")
+        # Wait for the content, or for the login form if the session has expired
         try:
-            page.wait_for_load_state("networkidle", timeout=20000)
+            page.locator(self.content_sel).or_(page.locator(self.user_sel)).first.wait_for(timeout=20000)
         except PWTimeoutError:
             pass
 
-        # Extract monitored content
-        # Option C: selector missing becomes a detectable "state"
+    def needs_login(self, page) -> bool:
+        # Cheap auth probe: a session that expired lands us back on the login form
+        return page.locator(self.user_sel).count() > 0
+
+    def ensure_logged_in(self, page):
+        if not self.ctx.cookies():
+            self.login(page)
+
+        # Go to the target page you want to monitor
+        self.open_target(page)
+        if self.needs_login(page):
+            self.login(page)
+            self.open_target(page)
+
+        write_atomic(AUTH_FILE, json.dumps(self.ctx.storage_state()))
+
+    def fetch_fast(self) -> str | None:
+        # Needs the cookies from a previous browser login
+        auth = load_auth()
+        if auth is None:
+            return None
+
+        jar = requests.cookies.RequestsCookieJar()
+        for c in auth["cookies"]:
+            jar.set(c["name"], c["value"], domain=c["domain"], path=c["path"])
+
         try:
-            page.wait_for_selector(content_sel, timeout=20000)
-            content = page.locator(content_sel).inner_text()
-        except PWTimeoutError:
-            stamp = datetime.now(ZoneInfo("America/Chicago")).strftime("%Y-%m-%d_%H-%M-%S")
-        
-            # Debug artifacts (super helpful)
-            page.screenshot(path=str(SNAPSHOT_DIR / f"{stamp}.missing_selector.png"), full_page=True)
-            (SNAPSHOT_DIR / f"{stamp}.missing_selector.html").write_text(page.content(), encoding="utf-8")
-        
-            # This becomes the monitored text so it hashes consistently
-            content = "Games No Longer Available"
+            r = _SESSION.get(self.target_url, cookies=jar, timeout=15)
+        except requests.RequestException:
+            return None
+        if r.status_code != 200:
+            return None
+
+        soup = BeautifulSoup(r.text, "lxml")
+        # Logged out, or the content is rendered by JS — let the browser handle it
+        if select_text(soup, self.user_sel) is not None:
+            return None
+        return select_text(soup, self.content_sel)
+
+    def fetch_content(self, stamp: str) -> tuple[str, str]:
+        # Returns (content, extractor). get_text() and inner_text() don't agree
+        # on hidden/inline text, so hashes are only comparable per extractor.
+        if self.fast_fetch:
+            content = self.fetch_fast()
+            if content is not None:
+                return content, "html"
+
+        if self.browser is None:
+            self.start()
+
+        page = self.ctx.new_page()
+        try:
+            self.ensure_logged_in(page)
+
+            # Extract monitored content
+            # Option C: selector missing becomes a detectable "state"
+            if page.locator(self.content_sel).count() == 0:
+                # Debug artifacts (super helpful)
+                page.screenshot(path=str(SNAPSHOT_DIR / f"{stamp}.missing_selector.png"), full_page=True)
+                (SNAPSHOT_DIR / f"{stamp}.missing_selector.html").write_text(page.content(), encoding="utf-8")
+
+                # This becomes the monitored text so it hashes consistently
+                return "Games No Longer Available", "browser"
+
+            return page.locator(self.content_sel).inner_text(), "browser"
+        finally:
+            page.close()
+
+
+def check(watcher: Watcher):
+    started = datetime.now(_CT)
+    now = started.strftime("%Y-%m-%d_%H-%M-%S")
 
-        browser.close()
+    if started.hour < 7:
+        print("Skipping due to quiet hours (12:00 AM–7:00 AM CT).")
+        return
+
+    last = load_last()
+
+    content, extractor = watcher.fetch_content(now)
 
     new_text = normalize_text(content)
     new_hash = sha256(new_text)
-    now = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-
-    if last_hash is None:
+    state = {
+        "hash": new_hash,
+        "tokens_hash": tokens_hash(new_text),
+        "timestamp": now,
+        "extractor": extractor,
+        "last_sends": last.get("last_sends", {}) if last else {},
+    }
+
+    if last is None:
         print("No previous snapshot found. Saving initial snapshot.")
-        save_state({"hash": new_hash, "text": new_text, "timestamp": now})
-        (SNAPSHOT_DIR / f"{now}.txt").write_text(new_text, encoding="utf-8")
+        save_state(state, new_text)
+        write_atomic(SNAPSHOT_DIR / f"{now}.txt", new_text)
+        prune_snapshots()
         return
 
-    if new_hash == last_hash:
+    if new_hash == last["hash"]:
         print("No change detected.")
         return
 
+    # State written before FAST_FETCH existed always came from the browser
+    if extractor != last.get("extractor", "browser"):
+        print(f"Extractor switched to {extractor}. Re-baselining without a diff.")
+        save_state(state, new_text)
+        return
+
+    if state["tokens_hash"] == last.get("tokens_hash"):
+        print("Cosmetic change only (case/punctuation). Updating state without a diff.")
+        save_state(state, new_text)
+        return
+
     print("CHANGE DETECTED ✅")
 
+    last_text = load_last_text(last)
     diff_text = write_diff(last_text, new_text)
-    (SNAPSHOT_DIR / f"{now}.txt").write_text(new_text, encoding="utf-8")
-    (SNAPSHOT_DIR / f"{now}.diff.txt").write_text(diff_text, encoding="utf-8")
+    write_atomic(SNAPSHOT_DIR / f"{now}.txt", new_text)
+    write_atomic(SNAPSHOT_DIR / f"{now}.diff.txt", diff_text)
+    prune_snapshots()
 
-    save_state({"hash": new_hash, "text": new_text, "timestamp": now})
+    notify = rate_limit(state, "change")
+    save_state(state, new_text)
 
     print(f"Saved snapshot: {SNAPSHOT_DIR / f'{now}.txt'}")
     print(f"Saved diff:     {SNAPSHOT_DIR / f'{now}.diff.txt'}")
-    send_pushover(f"CHANGE DETECTED: {new_text}")
+    if notify:
+        send_pushover(f"CHANGE DETECTED: {new_text}")
+    else:
+        print("Pushover rate limit reached; not sending.")
+
+def run_forever(watcher: Watcher, interval: float):
+    scheduler = sched.scheduler()
+
+    def tick():
+        scheduler.enter(interval, 1, tick)
+        try:
+            check(watcher)
+        except Exception as e:
+            # Keep the daemon alive; drop the browser so the next tick relaunches it
+            print(f"Check failed: {e!r}")
+            try:
+                watcher.close()
+            except Exception as close_err:
+                print(f"Browser shutdown failed: {close_err!r}")
+
+    scheduler.enter(0, 1, tick)
+    scheduler.run()
+
+def main():
+    # WATCH_INTERVAL (seconds) keeps the browser warm and checks in-process;
+    # without it we do a single check, which is what the scheduled workflow uses.
+    interval = float(os.getenv("WATCH_INTERVAL") or 0)
+
+    watcher = Watcher()
+    try:
+        if interval > 0:
+            run_forever(watcher, interval)
+        else:
+            check(watcher)
+    finally:
+        watcher.close()
+
 if __name__ == "__main__":
     main()
 